@@ -2,7 +2,7 @@ import polars as pl
 from polars import col as c
 import polars.selectors as cs
 from tables import load_base_table
-from expressions import get_margin_quantile, margin_stats, cum_margin, median_quantity, unit_margin
+from expressions import get_margin_quantile, margin_stats, cum_margin, median_quantity, unit_margin, extract_pbm
 import seaborn as sns
 import numpy as np
 from config import FIGURE_DIR
@@ -15,6 +15,61 @@ def get_all_margin_quantiles(lf: pl.LazyFrame = load_base_table(), min_quantile:
     # list comprehension to generate the quantile expressions for values between min_quantile and max_quantile
     return pl.concat([lf.select(get_margin_quantile(q), pl.lit(q).alias('quantile') ) for q in pl.arange(min_quantile, max_quantile + 1, 1, eager=True)]).with_columns(cum_margin())
 
+def add_quantile_markers(lf: pl.LazyFrame, by: list[str]) -> pl.LazyFrame:
+    """
+    Adds cumulative margin, the first profitable quantile and the cumulative break-even quantile
+    to long-format margin thresholds (margin_over_nadac per quantile), computed separately for every `by` group.
+    """
+    return (
+        lf
+        .sort(by + ['quantile'])
+        .with_columns(cum_margin().over(by))
+        .rename({'margin_over_nadac': 'margin_threshold'})
+        .with_columns(
+            c.quantile.filter(c.margin_threshold > 0).min().over(by).alias('first_profitable_quantile'),
+            c.quantile.filter(c.cumulative_margin > 0).min().over(by).alias('break_even_quantile'),
+        )
+    )
+
+def get_grouped_margin_quantiles(lf: pl.LazyFrame = load_base_table(), by: tuple[str, ...] = ('pbm', 'affiliate'), min_quantile: int = 1, max_quantile: int = 99, from_cube: bool = False) -> pl.LazyFrame:
+    """
+    Retrieves margin quantiles from min_quantile to max_quantile for every `by` group.
+
+    Claims are sorted once by group and margin, and each quantile threshold is picked by its
+    nearest-rank position (same rule as get_margin_quantile). With from_cube=True the thresholds
+    are estimated from the rollup cube sketches instead of the claim-level table.
+    Returns a long LazyFrame with the `by` keys, quantile, margin_threshold, cumulative_margin,
+    first_profitable_quantile and break_even_quantile.
+    """
+    by = list(by)
+    if from_cube:
+        # imported here so analysis does not require the cube to be built
+        from cube import load_rollup_cube, sketch_quantiles
+        thresholds = sketch_quantiles(load_rollup_cube(), by, min_quantile, max_quantile)
+        return add_quantile_markers(thresholds.rename({'margin_threshold': 'margin_over_nadac'}), by)
+
+    if 'pbm' in by:
+        lf = lf.with_columns(extract_pbm())
+    ranked = (
+        lf
+        .select(by + ['margin_over_nadac'])
+        .sort(by + ['margin_over_nadac'])
+        .with_columns(pl.int_range(pl.len()).over(by).alias('rank'))
+    )
+    positions = (
+        ranked
+        .group_by(by)
+        .agg(pl.len().alias('n'))
+        .join(pl.LazyFrame({'quantile': pl.arange(min_quantile, max_quantile + 1, 1, eager=True)}), how='cross')
+        .with_columns(((c.n - 1) * c.quantile / 100 + 0.5).floor().cast(pl.Int64).alias('rank'))
+    )
+    thresholds = (
+        ranked
+        .join(positions, on=by + ['rank'])
+        .select(by + ['quantile', 'margin_over_nadac'])
+    )
+    return add_quantile_markers(thresholds, by)
+
 def get_margin_stats() -> dict:
     return (
     load_base_table()
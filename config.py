@@ -11,3 +11,14 @@ BASE_TABLE = Path(os.getenv("BASE_TABLE")) #type: ignore
 FIGURE_DIR = Path('figures/fig')
 DATA_DIR = Path(os.getenv("DATA_DIR")) #type: ignore
 GA_DATABASE = DATA_DIR / 'ga.db' #type: ignore
+ROLLUP_CUBE_DIR = DATA_DIR / 'rollup_cube' #type: ignore
+NADAC_STORE = DATA_DIR / 'nadac_store.parquet' #type: ignore
+STATE_BASE_TABLE_DIR = DATA_DIR / 'state_base_tables' #type: ignore
+
+# per-state rules: regex matching the state's reports in 'source', statute threshold (fraction of NADAC)
+# and report period length in months (periods start in January).
+# Patterns match the state code as a delimited token (e.g. 'optum_ga'), never inside a word (e.g. 'vegas_nv').
+# Only Georgia's statute is encoded so far; add other states here as their rules are confirmed.
+STATE_RULES = {
+    'GA': {'source_pattern': '(?i)(^|[^a-z])ga([^a-z]|$)', 'threshold': 0.10, 'period_months': 4},
+}
@@ -0,0 +1,163 @@
+from models import StateFile, RollupCube
+import polars as pl
+from polars import col as c
+from config import ROLLUP_CUBE_DIR
+from tables import load_base_table
+from expressions import extract_pbm, dispensing_month, margin_sketch_bucket, sketch_bucket_value
+from pathlib import Path
+
+CUBE_KEYS = ['pbm', 'month', 'product', 'ndc', 'affiliate']
+PARTITION_KEYS = ['pbm', 'month']
+CUBE_MEASURES = ['rx_count', 'qty', 'total', 'nadac_total', 'margin_over_nadac']
+
+def aggregate_cube(lf: pl.LazyFrame) -> pl.LazyFrame:
+    """
+    Aggregates claim-level BaseTable rows into RollupCube rows keyed by CUBE_KEYS.
+    Measures are summed per sketch bucket first, so the totals and the margin sketch come from one pass.
+    Returns a Polars LazyFrame.
+    """
+    return (
+        lf
+        .with_columns(extract_pbm(), dispensing_month(), margin_sketch_bucket())
+        .group_by(CUBE_KEYS + ['bucket'])
+        .agg(
+            pl.len().cast(pl.Int64).alias('count'),
+            c.qty.sum(),
+            c.total.sum(),
+            c.nadac_total.sum(),
+            c.margin_over_nadac.sum(),
+        )
+        .group_by(CUBE_KEYS)
+        .agg(
+            c.count.sum().alias('rx_count'),
+            c.qty.sum(),
+            c.total.sum().round(2),
+            c.nadac_total.sum().round(2),
+            c.margin_over_nadac.sum().round(2),
+            pl.struct('bucket', 'count').sort_by('bucket').alias('margin_sketch'),
+        )
+        .select(RollupCube.columns)
+    )
+
+def partition_path(pbm: str, month) -> Path:
+    """
+    Returns the parquet file holding one (pbm, month) partition of the cube.
+    """
+    return ROLLUP_CUBE_DIR / f'{pbm}_{month:%Y-%m}.parquet'
+
+def write_partitions(cube: pl.DataFrame, partitions: pl.DataFrame):
+    """
+    Rewrites the listed (pbm, month) partitions from the cube rows.
+    Listed partitions without any cube rows are removed.
+    """
+    ROLLUP_CUBE_DIR.mkdir(exist_ok=True, parents=True)
+    parts = cube.partition_by(PARTITION_KEYS, as_dict=True)
+    for pbm, month in partitions.select(PARTITION_KEYS).iter_rows():
+        path = partition_path(pbm, month)
+        part = parts.get((pbm, month))
+        if part is None:
+            path.unlink(missing_ok=True)
+        else:
+            part.sort(CUBE_KEYS).write_parquet(path)
+
+def create_rollup_cube():
+    """
+    Rebuilds every partition of the rollup cube from the base table.
+    """
+    for path in ROLLUP_CUBE_DIR.glob('*.parquet'):
+        path.unlink()
+    cube = aggregate_cube(load_base_table()).collect(engine='streaming')
+    write_partitions(cube, cube.select(PARTITION_KEYS).unique())
+
+def update_rollup_cube(reports: list[Path]):
+    """
+    Rebuilds only the (pbm, month) partitions touched by the given state report files.
+    Run after create_base_table so the base table already holds the new reports.
+    """
+    touched = (
+        pl.scan_parquet(reports)
+        .select(StateFile.columns)
+        .select(extract_pbm(), dispensing_month())
+        .unique()
+        .collect()
+    )
+    cube = (
+        load_base_table()
+        .with_columns(extract_pbm(), dispensing_month())
+        # only scan claims that fall in a touched partition
+        .join(touched.lazy(), on=PARTITION_KEYS, how='semi')
+        .pipe(aggregate_cube)
+        .collect(engine='streaming')
+    )
+    write_partitions(cube, touched)
+
+def load_rollup_cube() -> pl.LazyFrame:
+    """
+    Loads all partitions of the rollup cube.
+    Returns a Polars LazyFrame.
+    """
+    return pl.scan_parquet(ROLLUP_CUBE_DIR / '*.parquet').select(RollupCube.columns)
+
+def merge_sketches(lf: pl.LazyFrame, by: list[str]) -> pl.LazyFrame:
+    """
+    Merges the margin sketches of all cube rows sharing the `by` keys by summing bucket counts.
+    """
+    return (
+        lf
+        .select(by + ['margin_sketch'])
+        .explode('margin_sketch')
+        .unnest('margin_sketch')
+        .group_by(by + ['bucket'])
+        .agg(c.count.sum())
+        .group_by(by)
+        .agg(pl.struct('bucket', 'count').sort_by('bucket').alias('margin_sketch'))
+    )
+
+def rollup(by: list[str], *predicates: pl.Expr, lf: pl.LazyFrame | None = None) -> pl.LazyFrame:
+    """
+    Rolls the cube up to the `by` keys, optionally filtering cube rows with predicates first.
+    Returns summed measures, mean margin per claim and the merged margin sketch per group.
+    """
+    cube = load_rollup_cube() if lf is None else lf
+    if predicates:
+        cube = cube.filter(*predicates)
+    return (
+        cube
+        .group_by(by)
+        .agg([c(m).sum() for m in CUBE_MEASURES])
+        .with_columns((c.margin_over_nadac / c.rx_count).round(2).alias('mean_margin_over_nadac'))
+        .join(merge_sketches(cube, by), on=by)
+        .sort(by)
+    )
+
+def drill_down(by: list[str], **slice_) -> pl.LazyFrame:
+    """
+    Drills into one slice of the cube, e.g. drill_down(['product'], pbm='OPTUM', affiliate=False).
+    The slice keys are kept in the output alongside the finer `by` keys.
+    """
+    return rollup(list(slice_) + by, *[c(k) == v for k, v in slice_.items()])
+
+def sketch_quantiles(lf: pl.LazyFrame, by: list[str], min_quantile: int = 1, max_quantile: int = 99) -> pl.LazyFrame:
+    """
+    Estimates margin quantiles per `by` group from the margin sketches of cube (or rolled up) rows.
+    Uses the same nearest-rank rule as get_margin_quantile.
+    Returns a long LazyFrame with the `by` keys, quantile and margin_threshold.
+    """
+    quantiles = pl.LazyFrame({'quantile': pl.arange(min_quantile, max_quantile + 1, 1, eager=True)})
+    return (
+        merge_sketches(lf, by)
+        .explode('margin_sketch')
+        .unnest('margin_sketch')
+        .with_columns(
+            c.count.cum_sum().over(by).alias('cum_count'),
+            c.count.sum().over(by).alias('n'),
+        )
+        .join(quantiles, how='cross')
+        # the nearest-rank position falls in the first bucket whose cumulative count reaches it
+        .filter(c.cum_count > ((c.n - 1) * c.quantile / 100 + 0.5).floor())
+        .group_by(by + ['quantile'])
+        .agg(c.bucket.min())
+        .with_columns(sketch_bucket_value())
+        .drop('bucket')
+        .sort(by + ['quantile'])
+    )
@@ -1,12 +1,40 @@
 import polars as pl
 from polars import col as c
 import polars.selectors as cs
+import math
 
-def ga_predicate() -> pl.Expr:
+# relative accuracy of the margin quantile sketch (DDSketch-style log buckets)
+SKETCH_RELATIVE_ACCURACY = 0.01
+SKETCH_GAMMA = (1 + SKETCH_RELATIVE_ACCURACY) / (1 - SKETCH_RELATIVE_ACCURACY)
+
+def extract_state(rules: dict) -> pl.Expr:
+    """
+    Derives the reporting state from the 'source' column using each state's 'source_pattern' (first match wins).
+    Patterns should match the state code as a delimited token so one state's code inside a word does not capture
+    another state's reports. Sources matching no state are null.
+    """
+    expr = pl
+    for state, rule in rules.items():
+        expr = expr.when(c.source.str.contains(rule['source_pattern'])).then(pl.lit(state))
+    return expr.otherwise(pl.lit(None, pl.String)).alias('state')
+
+def report_period(rules: dict) -> pl.Expr:
+    """
+    Returns the first day of the state's report period containing 'dos', using each state's 'period_months'.
+    """
+    expr = pl
+    for state, rule in rules.items():
+        expr = expr.when(c.state == state).then(c.dos.dt.truncate(f"{rule['period_months']}mo"))
+    return expr.otherwise(pl.lit(None, pl.Date)).alias('report_period')
+
+def outside_threshold(rules: dict) -> pl.Expr:
     """
-    Returns a Polars expression that matches rows where the 'source' column contains 'ga' (case-insensitive).
+    Flags claims reimbursed at least the state's statute 'threshold' (fraction of NADAC) below or above NADAC.
     """
-    return c.source.str.contains("(?i)ga")
+    expr = pl
+    for state, rule in rules.items():
+        expr = expr.when(c.state == state).then(c.margin_over_nadac.abs() >= c.nadac_total * rule['threshold'])
+    return expr.otherwise(pl.lit(None, pl.Boolean)).alias('outside_threshold')
 
 def nadac_total() -> pl.Expr:
     """
@@ -84,4 +112,52 @@ def median_quantity():
     return c.qty.median().cast(pl.Int64).alias('median_qty')
 
 def extract_pbm() -> pl.Expr:
-    return c.source.str.split("_").list.first().str.to_uppercase().alias('pbm')
\ No newline at end of file
+    return c.source.str.split("_").list.first().str.to_uppercase().alias('pbm')
+
+def dispensing_month() -> pl.Expr:
+    """
+    Truncates the 'dos' column to the first day of the dispensing month.
+    """
+    return c.dos.dt.truncate('1mo').alias('month')
+
+def margin_sketch_bucket() -> pl.Expr:
+    """
+    Maps 'margin_over_nadac' to a signed log-scale sketch bucket.
+    Bucket 0 holds margins under one cent, and bucket order follows margin order, so bucket counts
+    can be summed across groups and still answer quantile queries. Estimates are within
+    SKETCH_RELATIVE_ACCURACY of the cent-rounded margin, i.e. about 1% plus half a cent of the exact value.
+    """
+    cents = (c.margin_over_nadac.abs() * 100).round()
+    key = (cents.clip(lower_bound=1).log() / math.log(SKETCH_GAMMA)).ceil().cast(pl.Int32) + 1
+    return (
+        pl.when(cents < 1).then(pl.lit(0, pl.Int32))
+        .otherwise(c.margin_over_nadac.sign().cast(pl.Int32) * key)
+        .alias('bucket')
+    )
+
+def sketch_bucket_value() -> pl.Expr:
+    """
+    Returns the representative margin (USD) of the 'bucket' column, the inverse of margin_sketch_bucket.
+    Not rounded to cents, so the estimate keeps the sketch's relative accuracy.
+    """
+    magnitude = 2 * pl.lit(SKETCH_GAMMA).pow(c.bucket.abs() - 1) / (SKETCH_GAMMA + 1) / 100
+    return (c.bucket.sign() * magnitude).alias('margin_threshold')
+
+def reimbursement_gap(percent_add_on: float = 0) -> pl.Expr:
+    """
+    Returns the amount paid above NADAC plus a percentage add-on (total - nadac_total * (1 + percent_add_on / 100)).
+    A claim pays less under "NADAC + add-on + fee" when the gap is above the fee.
+    """
+    return (c.total - c.nadac_total * (1 + percent_add_on / 100)).round(2)
+
+def fee_grid_position(fee_grid: pl.Series, percent_add_on: float = 0) -> pl.Expr:
+    """
+    Places each claim's reimbursement_gap on the sorted fee grid as (fees below the gap) + (fees at or below it).
+    The position is even unless the gap equals a fee. For the fee at grid index k, claims with position <= 2k
+    are paid more under "NADAC + add-on + fee" and claims with position <= 2k + 1 are not paid less.
+    """
+    gap = reimbursement_gap(percent_add_on)
+    return (
+        pl.lit(fee_grid).search_sorted(gap, side='left').cast(pl.Int64)
+        + pl.lit(fee_grid).search_sorted(gap, side='right').cast(pl.Int64)
+    ).alias('fee_position')
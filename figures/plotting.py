@@ -13,7 +13,7 @@ from expressions import median_quantity, unit_margin, extract_pbm
 import seaborn as sns
 import matplotlib.pyplot as plt
 import matplotlib.ticker as mtick
-from analysis import starndard_margin_analysis
+from analysis import starndard_margin_analysis, get_grouped_margin_quantiles
 
 def plot_price_distribution(min_quantile: int = 1, max_quantile: int = 99, output: Path | None = None, plot_nadac = False) -> Path:
     """Create a publication-quality chart of margin distribution & cumulative margin.
@@ -475,6 +475,47 @@ def box_margin_plot(
     plt.savefig(out, dpi=300)
     print(out)
 
+def plot_grouped_price_distribution(facet: str = 'pbm', hue: str = 'affiliate', min_quantile: int = 1, max_quantile: int = 99, output: Path | None = None) -> Path:
+    """Facet the margin threshold curve by `facet` (one panel each) and colour it by `hue`.
+
+    Dotted vertical lines mark each curve's cumulative break-even quantile.
+    Returns the saved Path.
+    """
+    df = (
+        get_grouped_margin_quantiles(by=(facet, hue), min_quantile=min_quantile, max_quantile=max_quantile)
+        .collect(engine='streaming')
+        .to_pandas()
+    )
+    if df.empty:
+        raise ValueError('get_grouped_margin_quantiles returned no rows')
+    # categorical hue (e.g. affiliate True/False) so seaborn does not use a continuous palette
+    df[hue] = df[hue].astype(str)
+    hue_order = sorted(df[hue].unique())
+    palette = dict(zip(hue_order, sns.color_palette('Set2', len(hue_order))))
+
+    sns.set_theme(style='whitegrid', rc={'grid.linewidth': 0.5})
+    g = sns.relplot(
+        data=df, x='quantile', y='margin_threshold', col=facet, hue=hue, hue_order=hue_order,
+        kind='line', col_wrap=4, height=3.2, aspect=1.3, palette=palette, linewidth=1.6,
+    )
+    for name, ax in g.axes_dict.items():
+        ax.axhline(0, color='#444444', linewidth=0.9)
+        markers = df[df[facet] == name].drop_duplicates(hue)
+        for _, row in markers.iterrows():
+            if pd.notna(row['break_even_quantile']):
+                ax.axvline(row['break_even_quantile'], color=palette[row[hue]], linestyle=':', linewidth=1.2)
+        ax.yaxis.set_major_formatter(mtick.StrMethodFormatter('${x:,.0f}'))
+    g.set_axis_labels('Quantile (%)', 'Margin Threshold (USD)')
+    g.set_titles('{col_name}')
+    g.figure.suptitle(f'Margin Over NADAC Distribution by {facet} and {hue} (dotted: cumulative break-even)', y=1.02)
+
+    FIGURE_DIR.mkdir(exist_ok=True, parents=True)
+    if output is None:
+        output = FIGURE_DIR / f'price_distribution_by_{facet}_{hue}.png'
+    output.parent.mkdir(exist_ok=True, parents=True)
+    g.savefig(output, dpi=220)
+    plt.close(g.figure)
+    return output
 
 
 if __name__ == "__main__":
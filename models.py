@@ -15,6 +15,13 @@ class NadacTable(Model):
     effective_date: date
     as_of: date
 
+class NadacSnapshot(Model):
+    ndc: str
+    unit_price: float
+    valid_from: date
+    valid_to: date | None
+    first_seen: date
+
 class Medispan(Model):
     ndc: str
     product: str
@@ -31,5 +38,25 @@ class BaseTable(Model):
     source: str
     effective_date: date
 
-    
-    
+class StateBaseTable(BaseTable):
+    unit_price: float
+    state: str
+    report_period: date
+    outside_threshold: bool
+
+class SketchBucket(Model):
+    bucket: int
+    count: int
+
+class RollupCube(Model):
+    pbm: str
+    month: date
+    product: str
+    ndc: str
+    affiliate: bool
+    rx_count: int
+    qty: float
+    total: float
+    nadac_total: float
+    margin_over_nadac: float
+    margin_sketch: list[SketchBucket]
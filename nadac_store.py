@@ -0,0 +1,128 @@
+from models import NadacTable, NadacSnapshot
+import polars as pl
+from polars import col as c
+from config import NADAC_FILES, NADAC_STORE
+from datetime import date
+
+SNAPSHOT_KEYS = ['ndc', 'valid_from']
+
+def scan_nadac_files(since: date | None = None) -> pl.LazyFrame:
+    """
+    Scans the weekly NADAC publications, optionally only those published (as_of) after `since`.
+    Returns a Polars LazyFrame with the columns defined in NadacTable.
+    """
+    lf = (
+        pl.scan_parquet(NADAC_FILES)
+        .select(NadacTable.columns)
+        .with_columns([
+            c.unit_price.cast(pl.Float64).round(4),
+            c.effective_date.cast(pl.Date),
+            c.as_of.cast(pl.Date),
+        ])
+    )
+    if since is not None:
+        lf = lf.filter(c.as_of > since)
+    return lf
+
+def compact_snapshots(lf: pl.LazyFrame) -> pl.LazyFrame:
+    """
+    Collapses weekly re-publications of an unchanged price into one row per run of identical prices
+    for an (ndc, effective_date) in as_of order, keeping the first as_of date of the run.
+    A price that is changed and later changed back starts a new run with its own first_seen.
+    """
+    return (
+        lf
+        .sort('ndc', 'effective_date', 'as_of')
+        .filter((c.unit_price != c.unit_price.shift(1)).over('ndc', 'effective_date').fill_null(True))
+        .select('ndc', c.effective_date.alias('valid_from'), 'unit_price', c.as_of.alias('first_seen'))
+    )
+
+def with_valid_to(lf: pl.LazyFrame) -> pl.LazyFrame:
+    """
+    Sets valid_to to the day before the next effective date of the same ndc (null for the current price).
+    """
+    next_start = (
+        lf
+        .select('ndc', 'valid_from')
+        .unique()
+        .sort('ndc', 'valid_from')
+        .with_columns((c.valid_from.shift(-1).over('ndc') - pl.duration(days=1)).alias('valid_to'))
+    )
+    return (
+        lf
+        .drop('valid_to', strict=False)
+        .join(next_start, on=['ndc', 'valid_from'], how='left')
+        .select(NadacSnapshot.columns)
+    )
+
+def update_nadac_store(rebuild: bool = False):
+    """
+    Adds NADAC publications newer than the store's latest first_seen date to the compacted store.
+    A new publication only adds a row when its price differs from the latest stored price for that
+    ndc and effective date. Builds the store from all NADAC files when it does not exist yet or
+    when `rebuild` is True.
+
+    Only publications with as_of after the store's latest first_seen are scanned, so a late
+    backfilled week (as_of at or before that date) is skipped; use rebuild=True after adding one.
+    """
+    if NADAC_STORE.exists() and not rebuild:
+        store = pl.read_parquet(NADAC_STORE).select(NadacSnapshot.columns).drop('valid_to')
+        since = store['first_seen'].max()
+    else:
+        store = pl.DataFrame(schema=NadacSnapshot.dtypes).drop('valid_to')
+        since = None
+    current = latest_revision(store.lazy()).select(SNAPSHOT_KEYS + [c.unit_price.alias('current_price')])
+    new = (
+        scan_nadac_files(since)
+        .pipe(compact_snapshots)
+        .join(current, on=SNAPSHOT_KEYS, how='left')
+        # the first run of a key continues the stored price when the price is unchanged
+        .filter(~(
+            (c.first_seen == c.first_seen.min().over(SNAPSHOT_KEYS)) & (c.unit_price == c.current_price)
+        ).fill_null(False))
+        .drop('current_price')
+        .collect(engine='streaming')
+    )
+    # nothing published since the last update
+    if new.is_empty() and since is not None:
+        return
+    (
+        pl.concat([store, new.select(store.columns)])
+        .lazy()
+        .pipe(with_valid_to)
+        .sort(['ndc', 'valid_from', 'first_seen'])
+        .collect()
+        .write_parquet(NADAC_STORE)
+    )
+
+def load_nadac_store() -> pl.LazyFrame:
+    """
+    Loads the compacted NADAC store as last written by update_nadac_store.
+    Returns a Polars LazyFrame with the columns defined in NadacSnapshot.
+    """
+    return pl.scan_parquet(NADAC_STORE).select(NadacSnapshot.columns)
+
+def latest_revision(lf: pl.LazyFrame) -> pl.LazyFrame:
+    """
+    Keeps the most recently published price for every (ndc, valid_from) and recomputes valid_to.
+    """
+    return (
+        lf
+        .sort('first_seen')
+        .unique(['ndc', 'valid_from'], keep='last', maintain_order=True)
+        .pipe(with_valid_to)
+        .sort(['ndc', 'valid_from'])
+    )
+
+def nadac_latest() -> pl.LazyFrame:
+    """
+    Returns the latest known NADAC price history: one row per ndc and effective date.
+    """
+    return latest_revision(load_nadac_store())
+
+def nadac_as_published(on: date) -> pl.LazyFrame:
+    """
+    Returns the NADAC price history as CMS had published it on the date `on`,
+    ignoring prices and corrections first published after that date.
+    """
+    return latest_revision(load_nadac_store().filter(c.first_seen <= on))
@@ -0,0 +1,83 @@
+import polars as pl
+from polars import col as c
+from tables import load_base_table
+from expressions import extract_pbm, dispensing_month, fee_grid_position
+
+def fee_scenarios(fees: list[float], percent_add_ons: tuple[float, ...] = (0.0,)) -> pl.DataFrame:
+    """
+    Builds the scenario grid: every distinct dispensing fee (ascending) combined with every distinct
+    percentage add-on on NADAC. Scenarios are numbered add-on first, then fee.
+    """
+    if len(fees) == 0 or len(percent_add_ons) == 0:
+        raise ValueError('fees and percent_add_ons must each contain at least one value')
+    return (
+        pl.DataFrame({'percent_add_on': [float(p) for p in dict.fromkeys(percent_add_ons)]})
+        .join(pl.DataFrame({'fee': sorted({float(f) for f in fees})}), how='cross')
+        .with_row_index('scenario')
+        .with_columns(c.scenario.cast(pl.Int64))
+        .select('scenario', 'fee', 'percent_add_on')
+    )
+
+def simulate_dispensing_fees(fees: list[float], percent_add_ons: tuple[float, ...] = (0.0,), by: tuple[str, ...] = ('pbm', 'product', 'month'), lf: pl.LazyFrame = load_base_table()) -> pl.LazyFrame:
+    """
+    Evaluates "NADAC + percent add-on + dispensing fee" reimbursement against the actual claims
+    for every scenario in the fee grid, per `by` group, in one pass over the base table per add-on.
+
+    Each claim is placed on the sorted fee grid once (fee_grid_position). Per group the positions are
+    sorted once and a single binary search over the grid gives the cumulative counts, from which
+    winners and losers for every fee follow, so the fee grid is broadcast rather than looped over the claims.
+    Simulated totals follow from the group sums (nadac_total * (1 + add-on) + fee * rx_count).
+    Returns a long LazyFrame with the `by` keys, scenario, fee, percent_add_on, rx_count, total,
+    simulated_total, difference (simulated - actual), winners (claims the pharmacy would be paid more for
+    under the scenario) and losers (claims it would be paid less for).
+    """
+    by = list(by)
+    # a constant key stands in for the grand total so the claims can always be grouped
+    keys = by if by else ['all_claims']
+    scenarios = fee_scenarios(fees, percent_add_ons)
+    fee_grid = scenarios['fee'].unique(maintain_order=True)
+    add_ons = scenarios['percent_add_on'].unique(maintain_order=True)
+    grid_positions = pl.Series('fee_position', range(2 * fee_grid.len()), dtype=pl.Int64)
+    if 'pbm' in by:
+        lf = lf.with_columns(extract_pbm())
+    if 'month' in by:
+        lf = lf.with_columns(dispensing_month())
+    if not by:
+        lf = lf.with_columns(pl.lit(0).alias('all_claims'))
+    claims = lf.select(keys + ['total', 'nadac_total'])
+    return (
+        pl.concat([
+            claims
+            .with_columns(fee_grid_position(fee_grid, p))
+            .group_by(keys)
+            .agg(
+                pl.len().cast(pl.Int64).alias('rx_count'),
+                c.total.sum(),
+                c.nadac_total.sum(),
+                # number of claims with position <= 0, 1, ..., 2 * fees - 1
+                c.fee_position.sort().search_sorted(grid_positions, side='right').alias('cumulative_claims'),
+            )
+            .with_columns(pl.lit(i, pl.Int64).alias('add_on_index'))
+            for i, p in enumerate(add_ons)
+        ])
+        .sort(keys + ['add_on_index'])
+        .with_columns(
+            c.cumulative_claims.list.gather_every(2).alias('winners'),
+            c.cumulative_claims.list.gather_every(2, offset=1).alias('not_losers'),
+            pl.int_ranges(0, fee_grid.len()).alias('fee_index'),
+        )
+        .explode(['winners', 'not_losers', 'fee_index'])
+        .with_columns(
+            (c.add_on_index * fee_grid.len() + c.fee_index).alias('scenario'),
+            pl.lit(fee_grid).gather(c.fee_index).alias('fee'),
+            pl.lit(add_ons).gather(c.add_on_index).alias('percent_add_on'),
+            c.winners.cast(pl.Int64),
+            (c.rx_count - c.not_losers).cast(pl.Int64).alias('losers'),
+        )
+        .with_columns((c.nadac_total * (1 + c.percent_add_on / 100) + c.fee * c.rx_count).round(2).alias('simulated_total'))
+        .with_columns(
+            c.total.round(2),
+            (c.simulated_total - c.total).round(2).alias('difference'),
+        )
+        .select(by + ['scenario', 'fee', 'percent_add_on', 'rx_count', 'total', 'simulated_total', 'difference', 'winners', 'losers'])
+    )
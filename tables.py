@@ -1,10 +1,12 @@
-from models import StateFile, NadacTable, Medispan, BaseTable
+from models import StateFile, Medispan, BaseTable, StateBaseTable
 import polars as pl
 from polars import col as c
 import polars.selectors as cs
-from config import BASE_TABLE, STATE_DATA_DIR, NADAC_FILES, MEDISPAN_FILE
-from expressions import ga_predicate, nadac_total, margin_over_nadac
+from config import BASE_TABLE, STATE_DATA_DIR, MEDISPAN_FILE, STATE_BASE_TABLE_DIR, STATE_RULES
+from expressions import nadac_total, margin_over_nadac, extract_state, report_period, outside_threshold
+from nadac_store import load_nadac_store, update_nadac_store
 from pathlib import Path
+import shutil
 
 def load_state_table() -> pl.LazyFrame: 
     """
@@ -19,19 +21,15 @@ def load_state_table() -> pl.LazyFrame:
 
 def load_nadac_table() -> pl.LazyFrame:
     """
-    Loads NADAC data from parquet files, filters for matching effective and as_of dates,
-    selects columns defined in NadacTable, and sorts by 'ndc' and 'effective_date'.
+    Loads NADAC prices from the compacted NADAC store, keeping prices first published on their
+    effective date (the effective_date == as_of rows of the weekly files),
+    and sorts by 'ndc' and 'effective_date'.
     Returns a Polars LazyFrame.
     """
     return (
-        pl.scan_parquet(NADAC_FILES)
-        .filter(c.effective_date == c.as_of)
-        .with_columns([
-            c.unit_price.cast(pl.Float64).round(4),  # Ensure unit_price is Float64
-            c.effective_date.cast(pl.Date),
-        ])
-        .select(NadacTable.columns)
-        .drop('as_of')
+        load_nadac_store()
+        .filter(c.valid_from == c.first_seen)
+        .select('ndc', 'unit_price', c.valid_from.alias('effective_date'))
         .sort(by=['ndc','effective_date'])
     )
 
@@ -45,17 +43,19 @@ def load_medispan_table() -> pl.LazyFrame:
         .select(Medispan.columns)
     )
 
-def create_base_table(min_year: int = 2024, tolerance: str = '104w', output: Path = BASE_TABLE):
+def build_state_base_tables(min_year: int = 2024, tolerance: str = '104w', rules: dict = STATE_RULES) -> pl.LazyFrame:
     """
-    Loads and joins state data with Medispan and NADAC data for Georgia claims.
+    Loads and joins state data with Medispan and NADAC data for every state in `rules` in a single pass.
+    Rows are routed to a state by their 'source', and each state's report period and statute threshold are applied.
     Performs an asof join with NADAC data using a 104-week tolerance and calculates NADAC totals.
-    Write output to a parquet file.
+    Returns a Polars LazyFrame with the columns defined in StateBaseTable.
     """
-    (
+    return (
         # load data
         load_state_table()
-        # filter for ga reportings
-        .filter(ga_predicate())
+        # route rows to their reporting state, dropping sources of states without rules
+        .with_columns(extract_state(rules))
+        .filter(c.state.is_not_null())
         # filter for minimum year
         .filter(c.dos.dt.year() >= min_year)
         # add drug name
@@ -68,6 +68,35 @@ def create_base_table(min_year: int = 2024, tolerance: str = '104w', output: Pat
         .filter(c.unit_price.is_not_null())
         # calculate margin over nadac
         .with_columns(nadac_total(), margin_over_nadac())
+        # apply per-state rules
+        .with_columns(report_period(rules), outside_threshold(rules))
+        .select(StateBaseTable.columns)
+    )
+
+def create_state_base_tables(min_year: int = 2024, tolerance: str = '104w', output: Path = STATE_BASE_TABLE_DIR, rules: dict = STATE_RULES):
+    """
+    Builds the base tables of all states in `rules` from one scan of the claims and NADAC inputs.
+    Write output as parquet files partitioned by state (state=GA/...), replacing any previous partitions.
+    """
+    # bring the NADAC store up to date with the weekly files before pricing claims
+    update_nadac_store()
+    data = build_state_base_tables(min_year, tolerance, rules).collect(engine='streaming')
+    # remove old partitions so states no longer in `rules` do not linger
+    for path in output.glob('state=*'):
+        shutil.rmtree(path)
+    data.write_parquet(output, partition_by='state', mkdir=True)
+
+def create_base_table(min_year: int = 2024, tolerance: str = '104w', output: Path = BASE_TABLE):
+    """
+    Loads and joins state data with Medispan and NADAC data for Georgia claims.
+    Performs an asof join with NADAC data using a 104-week tolerance and calculates NADAC totals.
+    Write output to a parquet file, including the joined NADAC unit_price.
+    """
+    # bring the NADAC store up to date with the weekly files before pricing claims
+    update_nadac_store()
+    (
+        build_state_base_tables(min_year, tolerance, {'GA': STATE_RULES['GA']})
+        .select(BaseTable.columns + ['unit_price'])
         .collect(engine='streaming')
         .write_parquet(output)
     )
@@ -78,3 +107,13 @@ def load_base_table() -> pl.LazyFrame:
     Returns a Polars LazyFrame.
     """
     return pl.scan_parquet(BASE_TABLE).select(BaseTable.columns)
+
+def load_state_base_table(state: str | None = None) -> pl.LazyFrame:
+    """
+    Loads the per-state base tables, optionally for a single state.
+    Returns a Polars LazyFrame.
+    """
+    lf = pl.scan_parquet(STATE_BASE_TABLE_DIR / '**/*.parquet', hive_partitioning=True).select(StateBaseTable.columns)
+    if state is not None:
+        lf = lf.filter(c.state == state)
+    return lf